@@ -83,25 +83,53 @@ class Order:
                 return self.order_id, self.times[idx]
         raise ValueError
 
+    def get_despawn_time(self) -> Time:
+        for idx in reversed(range(len(self.times))):
+            if self.times[idx] is not None:
+                return self.times[idx]
+        raise ValueError
+
+    def has_same_times(self, other) -> bool:
+        return [str(t) for t in self.times] == [str(t) for t in other.times]
+
     def __repr__(self):
         return f"Schedule(number={self.order_id},eastbound={self.eastbound},times={self.times})"
 
 
 class Storage:
-    def __init__(self):
+    def __init__(self, station_id: str):
+        # The station the yard is drawn at
+        self.station_id = station_id
         self._count = {}
+        # Running total over every system, so it never needs summing
+        self._total = 0
+        # Called with this yard whenever its total changes
+        self.on_change = None
 
     def store(self, name: str):
         if name not in self._count.keys():
             self._count[name] = 0
         self._count[name] += 1
+        self._total += 1
+        self._changed()
 
     def withdraw(self, name: str):
         if self.has_any(name):
             self._count[name] -= 1
+            self._total -= 1
+            self._changed()
         else:
             self._count[name] = 0
 
+    def clear(self, name: str):
+        self._total -= self.get_count(name)
+        self._count[name] = 0
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
     def has_any(self, name: str) -> bool:
         if name not in self._count.keys():
             return False
@@ -113,10 +141,12 @@ class Storage:
         return self._count[name]
 
     def get_all_count(self) -> int:
-        return sum([v for _, v in self._count.items()])
+        return self._total
 
     def reset(self):
         self._count = {}
+        self._total = 0
+        self._changed()
 
 
 class Station:
@@ -152,19 +182,36 @@ class Station:
         return 0
 
 
+def color_to_string(color: (int, int, int)) -> str:
+    (r, g, b) = color
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+
 class Route:
-    def __init__(self, name: str, color: (int, int, int), stations: list[Station]):
+    def __init__(self, name: str, color: (int, int, int), stations: list[Station], train_color=(0, 0, 0),
+                 scale="major", terminals=None, schedule_files=None):
         self.name = name
         self.color = color
         self.stations = stations
+        self.train_color = train_color
+        # The scale of notes played as trains enter stations
+        self.scale = scale
+        # Yards where trains count as waiting at a terminal
+        self.terminals = terminals if terminals is not None else []
+        self.schedule_files = schedule_files if schedule_files is not None else []
 
     def color_as_string(self) -> str:
-        (r, g, b) = self.color
-        return f"#{r:02x}{g:02x}{b:02x}"
+        return color_to_string(self.color)
 
     def color_as_tuple(self) -> (int, int, int):
         return self.color
 
+    def train_color_as_string(self) -> str:
+        return color_to_string(self.train_color)
+
+    def train_color_as_tuple(self) -> (int, int, int):
+        return self.train_color
+
     def __getitem__(self, item):
         return self.stations[item]
 
@@ -172,6 +219,34 @@ class Route:
         return len(self.stations)
 
 
+class Network:
+    def __init__(self, stations: dict[str, Station], yards: dict[str, Storage], lines: list[Route]):
+        # Stations and yards, indexed by id
+        self.stations = stations
+        self.yards = yards
+        self.lines = lines
+        # Yards holding at least one train, kept up to date by the yards themselves
+        self.occupied_yards: set[Storage] = set()
+        for yard in yards.values():
+            yard.on_change = self._yard_changed
+
+    def _yard_changed(self, yard: Storage):
+        if yard.get_all_count() > 0:
+            self.occupied_yards.add(yard)
+        else:
+            self.occupied_yards.discard(yard)
+
+    def get_station(self, station_id: str) -> Station:
+        return self.stations[station_id]
+
+    def get_yard_station(self, yard: Storage) -> Station:
+        return self.stations[yard.station_id]
+
+    def reset(self):
+        for yard in self.yards.values():
+            yard.reset()
+
+
 class Schedule:
     def __init__(self, schedules: list[Order]):
         self.schedules = schedules
@@ -188,6 +263,11 @@ class Schedule:
     def get_order(self, train_number: str) -> Order:
         return self.route_map[train_number]
 
+    def replace(self, old, new):
+        # Swap the orders parsed from one file for a fresh parse of that file, in place.
+        self.schedules = [s for s in self.schedules if s.order_id not in old.route_map] + new.schedules
+        self.route_map = {order.order_id: order for order in self.schedules}
+
     def get_time_of_last_stop(self) -> Time:
         max_time = Time(0, 0, False)
         for schedule in self.schedules:
@@ -1,10 +1,19 @@
+import json
+import os
 import re
 from typing import Optional
 
-from models import Time, Order, Schedule, Station
+from models import Time, Order, Schedule, Station, Storage, Route, Network
 
 time_regex = re.compile("([0-9]{2}):([0-9]{2})(#?)")
 
+orientations = {
+    "above": Station.ABOVE,
+    "below": Station.BELOW,
+    "left": Station.LEFT,
+    "right": Station.RIGHT
+}
+
 
 def parse_schedules_from_csv(filename: str) -> Schedule:
     eastbound = "eastbound" in filename
@@ -32,6 +41,53 @@ def parse_time(time: str) -> Optional[Time]:
     return Time(int(parse.group(1)), int(parse.group(2)), parse.group(3) == "#")
 
 
+def parse_network_from_json(filename: str, storage_type=Storage) -> Network:
+    with open(filename, "r") as file:
+        raw = json.load(file)
+
+    yards = {y["id"]: storage_type(y["station"]) for y in raw["yards"]}
+    stations = {}
+    for s in raw["stations"]:
+        storage = yards[s["yard"]] if "yard" in s else None
+        stations[s["id"]] = Station(s["name"], s["x"], s["y"], orientations[s["orientation"]],
+                                    storage=storage, special=s.get("special", False))
+
+    lines = []
+    for line in raw["lines"]:
+        lines.append(Route(line["name"], tuple(line["color"]), [stations[sid] for sid in line["stations"]],
+                           train_color=tuple(line["train_color"]),
+                           scale=line.get("scale", "major"),
+                           terminals=[yards[yid] for yid in line.get("terminals", [])],
+                           schedule_files=line.get("schedules", [])))
+    return Network(stations, yards, lines)
+
+
 def find_orders_for_time(orders: list[(str, Time)], search_time: Time) -> list[str]:
     return [id for (id, otime) in orders if otime == search_time]
 
+
+class ScheduleFile:
+    """A schedule CSV on disk, remembered so it can be re-parsed when it is edited."""
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.mtime = os.path.getmtime(filename)
+        self.schedule = parse_schedules_from_csv(filename)
+
+    def has_changed(self) -> bool:
+        try:
+            return os.path.getmtime(self.filename) != self.mtime
+        except OSError:
+            # Some editors remove the file briefly while saving; check again next time.
+            return False
+
+    def reload(self, station_count: int) -> (Schedule, Schedule):
+        # Returns the (old, new) schedules. If the file can't be parsed, or any row doesn't have one
+        # value per station with at least one time, ValueError is raised and the old schedule is kept.
+        self.mtime = os.path.getmtime(self.filename)
+        new = parse_schedules_from_csv(self.filename)
+        for order in new.schedules:
+            if len(order.times) != station_count or all([t is None for t in order.times]):
+                raise ValueError(f"Train {order.order_id} needs {station_count} stops, with at least one time")
+        old = self.schedule
+        self.schedule = new
+        return old, self.schedule
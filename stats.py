@@ -0,0 +1,129 @@
+import csv
+
+import numpy as np
+
+from models import Schedule, Time, Network
+from script import parse_schedules_from_csv, parse_network_from_json
+
+
+# Statistics are computed for the whole day at once, from the schedules alone.
+# Each column holds one value per minute, describing the state once that minute has been simulated.
+
+
+def schedule_as_matrix(schedule: Schedule, station_count: int) -> np.ndarray:
+    # One row per order, one column per stop in the order's direction of travel. Skipped stops are NaN.
+    # Shaped explicitly, so a line with no orders still has a column per station.
+    return np.array([[np.nan if t is None else t.as_minutes() for t in order.times] for order in schedule.schedules],
+                    dtype=float).reshape(len(schedule.schedules), station_count)
+
+
+def count_intervals(starts: np.ndarray, ends: np.ndarray, first_minute: int, length: int) -> np.ndarray:
+    # How many [start, end) intervals cover each minute
+    diff = np.zeros(length + 1, dtype=np.int32)
+    np.add.at(diff, starts.astype(int) - first_minute, 1)
+    np.add.at(diff, ends.astype(int) - first_minute, -1)
+    return np.cumsum(diff[:-1])
+
+
+def check_time_order(schedule: Schedule, matrix: np.ndarray):
+    # Interval counting needs each train's times to never go backwards, which a missing '#' after midnight breaks
+    for order, row in zip(schedule.schedules, matrix):
+        if (np.diff(row[~np.isnan(row)]) < 0).any():
+            raise ValueError(f"Train {order.order_id} has stops out of time order")
+
+
+def yard_count(withdraw_minutes: np.ndarray, store_minutes: np.ndarray, first_minute: int, length: int) -> np.ndarray:
+    # Within a minute, trains leave a yard before others arrive, so each minute gets two steps.
+    # Withdrawing from an empty yard leaves it empty, which is a running max(0, count + step).
+    steps = np.zeros(2 * length, dtype=np.int32)
+    np.add.at(steps, 2 * (withdraw_minutes.astype(int) - first_minute), -1)
+    np.add.at(steps, 2 * (store_minutes.astype(int) - first_minute) + 1, 1)
+    total = np.cumsum(steps)
+    count = total - np.minimum(np.minimum.accumulate(total), 0)
+    return count[1::2]
+
+
+def compute_statistics(network: Network, schedules: list[Schedule]) -> (np.ndarray, list[str], np.ndarray):
+    # Takes one schedule per line of the network.
+    # Returns the minutes covered, the column names, and a (minutes x columns) array of counts.
+    matrices = [schedule_as_matrix(schedule, len(route)) for route, schedule in zip(network.lines, schedules)]
+    if all([m.size == 0 for m in matrices]):
+        raise ValueError("No line has any trains scheduled")
+    first_minute = int(min([np.nanmin(m) for m in matrices if m.size > 0]))
+    last_minute = int(max([np.nanmax(m) for m in matrices if m.size > 0]))
+    length = last_minute - first_minute + 1
+    minutes = np.arange(first_minute, last_minute + 1)
+
+    names = []
+    columns = []
+    for route, schedule, relative in zip(network.lines, schedules, matrices):
+        check_time_order(schedule, relative)
+        eastbound = np.array([order.eastbound for order in schedule.schedules], dtype=bool)
+        stops = ~np.isnan(relative)
+        first_stop = np.argmax(stops, axis=1)
+        last_stop = relative.shape[1] - 1 - np.argmax(stops[:, ::-1], axis=1)
+        rows = np.arange(len(relative))
+        spawn = relative[rows, first_stop]
+        despawn = relative[rows, last_stop]
+
+        # A train is running from its first stop until it reaches its last stop
+        running = count_intervals(spawn, despawn, first_minute, length)
+
+        # Dwelling: sitting at a stop, other than the last, on the minute it is scheduled there
+        distinct = np.ones_like(stops)
+        distinct[:, 1:] = relative[:, 1:] != relative[:, :-1]
+        dwell_times = relative[stops & distinct & (relative < despawn[:, None])]
+        dwelling = count_intervals(dwell_times, dwell_times + 1, first_minute, length)
+
+        names += [f"{route.name} in motion", f"{route.name} dwelling"]
+        columns += [running - dwelling, dwelling]
+
+        # Yards, found through the stations where each train starts and finishes
+        station_count = relative.shape[1]
+        spawn_station = np.where(eastbound, first_stop, station_count - 1 - first_stop)
+        despawn_station = np.where(eastbound, last_stop, station_count - 1 - last_stop)
+        for yard in network.yards.values():
+            at_yard = np.array([route[idx].storage is yard for idx in range(len(route))], dtype=bool)
+            if not at_yard.any():
+                continue
+            names.append(f"{network.get_yard_station(yard).name} yard ({route.name})")
+            columns.append(yard_count(spawn[at_yard[spawn_station]], despawn[at_yard[despawn_station]],
+                                      first_minute, length))
+
+        # Station pairs, in either direction. Columns are flipped so they follow the route's station order.
+        absolute = np.where(eastbound[:, None], relative, relative[:, ::-1])
+        for idx in range(len(route) - 1):
+            depart = np.fmin(absolute[:, idx], absolute[:, idx + 1])
+            arrive = np.fmax(absolute[:, idx], absolute[:, idx + 1])
+            served = ~np.isnan(absolute[:, idx]) & ~np.isnan(absolute[:, idx + 1])
+            names.append(f"{route.name}: {route[idx].name} - {route[idx + 1].name}")
+            columns.append(count_intervals(depart[served] + 1, arrive[served], first_minute, length))
+
+    return minutes, names, np.stack(columns, axis=1).astype(np.int32)
+
+
+def minute_as_string(minute: int) -> str:
+    return str(Time(0, 0, False) + int(minute))
+
+
+def save_csv(filename: str, minutes: np.ndarray, names: list[str], data: np.ndarray):
+    with open(filename, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["minute", "time"] + names)
+        for minute, row in zip(minutes, data):
+            writer.writerow([minute, minute_as_string(minute)] + row.tolist())
+
+
+def save_npz(filename: str, minutes: np.ndarray, names: list[str], data: np.ndarray):
+    np.savez_compressed(filename, minutes=minutes, columns=np.array(names), data=data)
+
+
+if __name__ == "__main__":
+    network = parse_network_from_json("network.json")
+    schedules = [Schedule([order for f in line.schedule_files for order in parse_schedules_from_csv(f).schedules])
+                 for line in network.lines]
+
+    minutes, names, data = compute_statistics(network, schedules)
+    save_csv("stats.csv", minutes, names, data)
+    save_npz("stats.npz", minutes, names, data)
+    print(f"Wrote {len(names)} columns for {len(minutes)} minutes to stats.csv and stats.npz")
@@ -1,51 +1,19 @@
 import tkinter as tk
 import tkinter.messagebox as mb
+import tkinter.ttk as ttk
 from typing import Optional
 
 import beep_boop
-from models import Schedule, Train, Station, Time, Route, Order
-from script import parse_schedules_from_csv, find_orders_for_time
-from uimodels import UITrain, UIStorage, CanvasWrapper
+from models import Schedule, Train, Time, Route, Network, Order, Station
+from script import find_orders_for_time, ScheduleFile, parse_network_from_json
+from uimodels import UITrain, UIStorage, CanvasWrapper, GifExport
 from beep_boop import play_major, play_minor
 
 time_step = 100
-
-fw_terminal = UIStorage(0)
-dal_terminal = UIStorage(9)
-irving_yard = UIStorage(10)
-airport_terminal = UIStorage(17)
-texrail_yard = UIStorage(18)
-
-all_stations = [
-    # TRE Stations and yards
-    Station("Fort Worth T&P Station", 50, 350, Station.RIGHT, storage=fw_terminal),
-    Station("Fort Worth Central Station", 50, 325, Station.RIGHT),
-    Station("Richland Hills", 150, 260, Station.ABOVE),
-    Station("Bell", 250, 200, Station.BELOW),
-    Station("CentrePort/ DFW Airport", 350, 200, Station.ABOVE, storage=irving_yard, special=True),
-    Station("West Irving", 450, 200, Station.BELOW, storage=irving_yard),
-    Station("Downtown Irving/ Heritage Crossing", 550, 200, Station.ABOVE),
-    Station("Medical/ Market Center", 650, 200, Station.RIGHT),
-    Station("Victory Station @ AA Center", 725, 275, Station.LEFT),
-    Station("EBJ Union Station", 800, 350, Station.LEFT, storage=dal_terminal),
-    Station("TRE Yard", 400, 250, Station.BELOW, storage=irving_yard),
-    # TEXRail Stations and yards
-    Station("North Side", 50, 200, Station.RIGHT, storage=texrail_yard),
-    Station("Mercantile Center", 100, 150, Station.RIGHT, storage=texrail_yard),
-    Station("Iron Horse", 150, 100, Station.LEFT),
-    Station("Smithfield", 200, 50, Station.LEFT),
-    Station("Grapevine", 300, 50, Station.BELOW),
-    Station("DFW Airport North", 350, 50, Station.RIGHT),
-    Station("DFW Airport Terminal B", 350, 100, Station.RIGHT, storage=airport_terminal),
-    Station("TEXRail Yard", 125, 175, Station.RIGHT, storage=texrail_yard)
-]
-
-all_yards = [
-    fw_terminal, dal_terminal, irving_yard, airport_terminal, texrail_yard
-]
-
-tre = Route("TRE", (15, 56, 144), all_stations[0:10])
-texrail = Route("TEXRail", (0, 0, 0), all_stations[0:2] + all_stations[11:18])
+# How often the schedule files are checked for edits
+watch_step = 500
+# How often the GIF export progress is refreshed
+export_step = 200
 
 def lerp(p1, p2, t):
     return ((p2 - p1) * t) + p1
@@ -61,22 +29,21 @@ class CanvasManager:
 
 
 class Simulation(CanvasManager):
-    def __init__(self, c: CanvasWrapper, schedule: Schedule, route: Route):
+    def __init__(self, c: CanvasWrapper, sources: list[ScheduleFile], route: Route):
         super().__init__(c)
-        self.schedule = schedule
+        # The files the schedule was parsed from, so edits can be reloaded
+        self.sources = sources
+        self.schedule = Schedule([order for source in sources for order in source.schedule.schedules])
         self.canvas = c
         self.route = route
         # The order that trains are spawned in, sorted by time.
-        self.spawn_order = schedule.get_spawn_order()
+        self.spawn_order = self.schedule.get_spawn_order()
         # UI elements
         self.trains: list[UITrain] = []
 
     def get_summary(self):
         in_motion = len(self.trains)
-        if self.route.name == "TRE":
-            in_idle = fw_terminal.get_count(self.route.name) + dal_terminal.get_count(self.route.name)
-        else:
-            in_idle = fw_terminal.get_count(self.route.name) + airport_terminal.get_count(self.route.name)
+        in_idle = sum([terminal.get_count(self.route.name) for terminal in self.route.terminals])
         return f"{in_motion + in_idle} train(s) running ({in_idle} waiting at terminal)"
 
     def get_x_y_for_train(self, t: Train):
@@ -92,21 +59,80 @@ class Simulation(CanvasManager):
     def draw_train(self, train: UITrain):
         (x, y) = self.get_x_y_for_train(train)
         self.delete_from_ui(train.ui)
-        train.ui = self.canvas.draw_train(x, y, train)
+        train.ui = self.canvas.draw_train(x, y, self.route)
 
     def play_train_beeps(self):
         for train in self.trains:
             if not train.is_between_stops():
-                if self.route.name == "TRE":
+                if self.route.scale == "major":
                     play_major(train.current_leg)
                 else:
                     play_minor(train.current_leg)
 
     def reset(self):
         for train in self.trains:
-            self.canvas.delete(train.ui)
+            self.delete_from_ui(train.ui)
         self.trains = []
 
+    def get_station_at(self, order: Order, time: Time) -> Station:
+        train = Train(order, self.route.name)
+        train.advance_to_time(time)
+        return self.route[train.current_leg]
+
+    def rebuild_yards(self, time: Time):
+        # Replays every withdrawal and store on this line before this minute, in the order update makes them.
+        # Within a minute, trains leave the yards before others arrive.
+        for yard in {station.storage for station in self.route.stations if station.storage is not None}:
+            yard.clear(self.route.name)
+        events = []
+        for order in self.schedule.schedules:
+            (_, spawn_time) = order.get_spawn_place_and_time()
+            despawn_time = order.get_despawn_time()
+            if spawn_time < time:
+                events.append((spawn_time.as_minutes(), 0, self.get_station_at(order, spawn_time)))
+            if despawn_time < time:
+                events.append((despawn_time.as_minutes(), 1, self.get_station_at(order, despawn_time)))
+        for (_, is_store, station) in sorted(events, key=lambda event: event[:2]):
+            if is_store:
+                station.store_train(self.route.name)
+            else:
+                station.withdraw_train(self.route.name)
+
+    def reload(self, old: Schedule, new: Schedule, time: Time):
+        self.schedule.replace(old, new)
+        self.spawn_order = self.schedule.get_spawn_order()
+
+        # Only trains whose times were added, removed or edited are touched
+        affected = set(old.route_map.keys()) ^ set(new.route_map.keys())
+        for order_id in set(old.route_map.keys()) & set(new.route_map.keys()):
+            if not old.get_order(order_id).has_same_times(new.get_order(order_id)):
+                affected.add(order_id)
+
+        kept_trains = []
+        for t in self.trains:
+            if t.order.order_id in affected:
+                self.delete_from_ui(t.ui)
+            else:
+                kept_trains.append(t)
+        self.trains = kept_trains
+
+        # Yards end up as if the new orders had been followed all along
+        self.rebuild_yards(time)
+
+        # Re-place affected trains that are already in service at this minute, where the kept trains
+        # were left by the last update. Trains that spawn at or after this minute are picked up by update as usual.
+        last_update = Time(0, 0, False) + (time.as_minutes() - 1)
+        for order_id in affected:
+            if order_id not in new.route_map:
+                continue
+            order = new.get_order(order_id)
+            (_, spawn_time) = order.get_spawn_place_and_time()
+            if spawn_time < time <= order.get_despawn_time():
+                train = UITrain(order, self.route.name)
+                train.advance_to_time(last_update)
+                self.trains.append(train)
+                self.draw_train(train)
+
     def update(self, time: Time):
         # Move all trains along the route
         for train in self.trains:
@@ -126,7 +152,7 @@ class Simulation(CanvasManager):
         cleaned_trains = []
         for t in self.trains:
             if t.is_complete():
-                self.canvas.delete(t.ui)
+                self.delete_from_ui(t.ui)
                 self.route[t.current_leg].store_train(self.route.name)
             else:
                 cleaned_trains.append(t)
@@ -136,10 +162,13 @@ class Simulation(CanvasManager):
 
 
 class GlobalSimulation(CanvasManager):
-    def __init__(self, c: CanvasWrapper, children: list[Simulation]):
+    def __init__(self, c: CanvasWrapper, network: Network, children: list[Simulation]):
         super().__init__(c)
         self.canvas = c
+        self.network = network
         self.children = children
+        # Yards currently drawn on the canvas
+        self.drawn_yards = []
         # Current time of the simulation
         self.start_time = self.time = min([s.spawn_order[0][1] for s in children if len(s.spawn_order) > 0])
         # End time of the simulation
@@ -155,10 +184,19 @@ class GlobalSimulation(CanvasManager):
         self.clock_ui = self.canvas.create_text(10, 10, text=clock_text, anchor=tk.W)
 
     def update_storage(self):
-        for yard in all_yards:
+        for yard in self.drawn_yards:
             self.delete_from_ui(yard.ui)
-            if yard.get_all_count() > 0:
-                yard.ui = self.canvas.draw_storage(all_stations[yard.station_idx])
+            yard.ui = None
+        self.drawn_yards = list(self.network.occupied_yards)
+        for yard in self.drawn_yards:
+            yard.ui = self.canvas.draw_storage(self.network.get_yard_station(yard))
+
+    def redraw(self):
+        # Puts the yards and trains back where they belong after the view has moved
+        self.update_storage()
+        for child in self.children:
+            for train in child.trains:
+                child.draw_train(train)
 
     def update_summaries(self):
         for idx, child in enumerate(self.children):
@@ -187,7 +225,32 @@ class GlobalSimulation(CanvasManager):
         self.update_summaries()
         self.canvas.end_of_frame()
         if mb.askokcancel(title="Save?", message="Save output as GIF?"):
-            self.canvas.save_gif("output.gif")
+            ExportWindow(self.canvas.save_gif("output.gif"))
+
+    def watch_schedules(self):
+        reloaded = False
+        try:
+            for child in self.children:
+                for source in child.sources:
+                    if not source.has_changed():
+                        continue
+                    try:
+                        (old, new) = source.reload(len(child.route))
+                    except (ValueError, OSError) as e:
+                        print(f"Could not parse {source.filename}, keeping the previous schedule: {e}")
+                        continue
+                    child.reload(old, new, self.time)
+                    reloaded = True
+                    print(f"Reloaded {source.filename}")
+            self.start_time = min([s.spawn_order[0][1] for s in self.children if len(s.spawn_order) > 0])
+            self.end_time = max([s.schedule.get_time_of_last_stop() for s in self.children])
+            if reloaded:
+                # Yards and summaries otherwise stay stale until the next tick, which never comes while paused
+                self.update_storage()
+                self.update_summaries()
+        finally:
+            # Keep watching, even if a reload went wrong
+            self.canvas.after(watch_step, self.watch_schedules)
 
     def pause(self):
         self.paused = True
@@ -202,17 +265,59 @@ class GlobalSimulation(CanvasManager):
         [s.reset() for s in self.children]
         self.update_summaries()
         self.update_clock()
-        [yard.reset() for yard in all_yards]
+        self.network.reset()
         self.update_storage()
 
 
-tre_eastbound = parse_schedules_from_csv("schedules/eastbound_weekday.csv")
-tre_westbound = parse_schedules_from_csv("schedules/westbound_weekday.csv")
-tre_schedule = tre_eastbound + tre_westbound
+class ExportWindow:
+    def __init__(self, export: GifExport):
+        self.export = export
+        self.window = tk.Toplevel()
+        self.window.title("Saving GIF")
+        self.progress = ttk.Progressbar(self.window, length=300, maximum=export.get_frame_count())
+        self.progress.grid(column=0, row=0, padx=10, pady=10)
+        self.label = tk.Label(self.window, text="Encoding frames...")
+        self.label.grid(column=0, row=1, padx=10)
+        self.button = tk.Button(self.window, text="Cancel", command=self.cancel)
+        self.button.grid(column=0, row=2, pady=10)
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.window.after(export_step, self.poll)
+
+    def poll(self):
+        export = self.export
+        self.progress["value"] = export.frames_done
+        if export.finished:
+            if export.error is not None:
+                self.window.destroy()
+                mb.showerror(title="Save failed", message=f"Could not save {export.filename}: {export.error}")
+            elif export.is_cancelled():
+                self.window.destroy()
+            else:
+                self.label.configure(text=f"Saved {export.filename}")
+                self.button.configure(text="Close", command=self.window.destroy)
+                self.window.protocol("WM_DELETE_WINDOW", self.window.destroy)
+            return
+
+        remaining = export.get_time_remaining()
+        if export.is_cancelled():
+            text = "Cancelling..."
+        elif export.frames_done >= export.get_frame_count():
+            text = "Writing file..."
+        elif remaining is None:
+            text = "Encoding frames..."
+        else:
+            text = f"Encoded {export.frames_done}/{export.get_frame_count()} frames, about {remaining:.0f}s remaining"
+        self.label.configure(text=text)
+        self.window.after(export_step, self.poll)
+
+    def cancel(self):
+        # The window closes once the worker has stopped and cleaned up
+        self.export.cancel()
+        self.button["state"] = "disabled"
+
 
-texrail_eastbound = parse_schedules_from_csv("schedules/texrail_eastbound.csv")
-texrail_westbound = parse_schedules_from_csv("schedules/texrail_westbound.csv")
-texrail_schedule = texrail_eastbound + texrail_westbound
+network = parse_network_from_json("network.json", storage_type=UIStorage)
+sources = [[ScheduleFile(filename) for filename in line.schedule_files] for line in network.lines]
 
 print("Parsing schedules complete")
 
@@ -220,15 +325,18 @@ window = tk.Tk()
 window.title("Fort Worth Simulator")
 canvas = CanvasWrapper(tk.Canvas(width=850, height=400))
 
-canvas.draw_route(texrail)
-canvas.draw_route(tre)
+# Earlier lines are drawn on top
+for line in reversed(network.lines):
+    canvas.draw_route(line)
 # Station circles
-for station in all_stations:
+for station in network.stations.values():
     canvas.draw_station(station)
+canvas.refresh()
 
-tre_simulation = Simulation(canvas, tre_schedule, tre)
-texrail_simulation = Simulation(canvas, texrail_schedule, texrail)
-global_sim = GlobalSimulation(canvas, [tre_simulation, texrail_simulation])
+simulations = [Simulation(canvas, line_sources, line) for line, line_sources in zip(network.lines, sources)]
+global_sim = GlobalSimulation(canvas, network, simulations)
+canvas.on_view_change.append(global_sim.redraw)
+window.after(watch_step, global_sim.watch_schedules)
 
 canvas.canvas.grid(column=0, row=0, columnspan=5)
 
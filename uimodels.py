@@ -1,3 +1,7 @@
+import os
+import tempfile
+import threading
+import time
 import tkinter as tk
 from typing import Optional
 
@@ -15,22 +19,22 @@ class UITrain(Train):
 
 
 class UIStorage(Storage):
-    def __init__(self, station_idx: int):
-        super().__init__()
+    def __init__(self, station_id: str):
+        super().__init__(station_id)
         self.ui = None
-        self.station_idx = station_idx
 
 
 
-def get_x_y_anchor_for_station_names(station: Station) -> (int, int, str):
+def get_x_y_anchor_for_station_names(station: Station, x: float, y: float) -> (int, int, str):
+    # x and y are where the station is drawn on screen
     if station.name_orientation == Station.RIGHT:
-        return station.x + station_radius + 10, station.y, tk.W
+        return x + station_radius + 10, y, tk.W
     elif station.name_orientation == Station.LEFT:
-        return station.x - station_radius - 10, station.y, tk.E
+        return x - station_radius - 10, y, tk.E
     elif station.name_orientation == Station.ABOVE:
-        return station.x, station.y - station_radius - 10, tk.CENTER
+        return x, y - station_radius - 10, tk.CENTER
     else:
-        return station.x, station.y + station_radius + 10, tk.CENTER
+        return x, y + station_radius + 10, tk.CENTER
 
 
 anchor_map = {
@@ -39,6 +43,81 @@ anchor_map = {
     tk.E: "rm"
 }
 
+# How far outside the view, in screen pixels, items are still drawn. Enough for station names.
+view_margin = 250
+min_zoom = 0.5
+max_zoom = 8.0
+
+
+class Viewport:
+    """Maps map coordinates to screen coordinates for the current zoom and pan."""
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.scale = 1.0
+        self.offset_x = 0.0
+        self.offset_y = 0.0
+
+    def to_screen(self, x: float, y: float) -> (float, float):
+        return (x - self.offset_x) * self.scale, (y - self.offset_y) * self.scale
+
+    def to_map(self, x: float, y: float) -> (float, float):
+        return x / self.scale + self.offset_x, y / self.scale + self.offset_y
+
+    def get_bounds(self, margin: float) -> (float, float, float, float):
+        # The visible area in map coordinates, grown by a margin given in screen pixels
+        (x0, y0) = self.to_map(-margin, -margin)
+        (x1, y1) = self.to_map(self.width + margin, self.height + margin)
+        return x0, y0, x1, y1
+
+    def is_visible(self, x: float, y: float, margin: float) -> bool:
+        (sx, sy) = self.to_screen(x, y)
+        return -margin <= sx <= self.width + margin and -margin <= sy <= self.height + margin
+
+    def zoom(self, factor: float, x: float, y: float):
+        # Keeps the map point under the screen point (x, y) where it is
+        (map_x, map_y) = self.to_map(x, y)
+        self.scale = min(max(self.scale * factor, min_zoom), max_zoom)
+        self.offset_x = map_x - x / self.scale
+        self.offset_y = map_y - y / self.scale
+
+    def pan(self, dx: float, dy: float):
+        self.offset_x -= dx / self.scale
+        self.offset_y -= dy / self.scale
+
+    def reset(self):
+        self.scale = 1.0
+        self.offset_x = 0.0
+        self.offset_y = 0.0
+
+
+class GridIndex:
+    """A uniform grid over map coordinates, for finding the items in an area without checking them all."""
+    def __init__(self, cell_size: int = 100):
+        self.cell_size = cell_size
+        self.cells: dict[(int, int), list[(int, object)]] = {}
+        self.count = 0
+
+    def _cells_for(self, bounds: (float, float, float, float)):
+        (x0, y0, x1, y1) = bounds
+        for cx in range(int(x0 // self.cell_size), int(x1 // self.cell_size) + 1):
+            for cy in range(int(y0 // self.cell_size), int(y1 // self.cell_size) + 1):
+                yield cx, cy
+
+    def insert(self, item, bounds: (float, float, float, float)):
+        # Items come back from query in the order they were inserted, which is the order they are drawn
+        for cell in self._cells_for(bounds):
+            self.cells.setdefault(cell, []).append((self.count, item))
+        self.count += 1
+
+    def query(self, bounds: (float, float, float, float)) -> list:
+        found = {}
+        for cell in self._cells_for(bounds):
+            for (order, item) in self.cells.get(cell, []):
+                found[order] = item
+        return [found[order] for order in sorted(found.keys())]
+
+
 class CanvasWrapper:
     def __init__(self, canvas: tk.Canvas):
         self.canvas = canvas
@@ -46,7 +125,20 @@ class CanvasWrapper:
         self.images: list[Image] = []
         self.current_image: Optional[Image] = None
         self.current_frame: Optional[ImageDraw] = None
-        self.backgrounds = []
+        # Route segments and stations, and the ones in view
+        self.index = GridIndex()
+        self.visible = []
+        self.viewport = Viewport(int(canvas["width"]), int(canvas["height"]))
+        # Called after zooming or panning, to redraw anything not in the background
+        self.on_view_change = []
+        self.drag_from: Optional[(int, int)] = None
+
+        self.canvas.bind("<MouseWheel>", lambda e: self.zoom(1.25 if e.delta > 0 else 0.8, e.x, e.y))
+        self.canvas.bind("<Button-4>", lambda e: self.zoom(1.25, e.x, e.y))
+        self.canvas.bind("<Button-5>", lambda e: self.zoom(0.8, e.x, e.y))
+        self.canvas.bind("<ButtonPress-1>", self.start_drag)
+        self.canvas.bind("<B1-Motion>", self.drag)
+        self.canvas.bind("<Double-Button-1>", lambda e: self.reset_view())
 
     def pack(self):
         self.canvas.pack()
@@ -55,7 +147,9 @@ class CanvasWrapper:
         self.canvas.delete(tag)
 
     def create_text(self, x, y, text='', anchor=tk.CENTER) -> int:
-        self.current_frame.text((x, y), text, anchor=anchor_map[anchor], fill=(0,0,0), font=self.font)
+        # Summaries refreshed by a schedule reload are drawn between frames
+        if self.current_frame is not None:
+            self.current_frame.text((x, y), text, anchor=anchor_map[anchor], fill=(0,0,0), font=self.font)
         return self.canvas.create_text(x, y, text=text, anchor=anchor)
 
     def reset(self):
@@ -65,11 +159,11 @@ class CanvasWrapper:
         self.start_of_frame()
 
     def start_of_frame(self):
-        self.current_image = Image.new("RGB", (850, 400), (255, 255, 255))
+        self.current_image = Image.new("RGB", (self.viewport.width, self.viewport.height), (255, 255, 255))
         self.current_frame = ImageDraw.Draw(self.current_image)
 
-        for callback in self.backgrounds:
-            callback()
+        for item in self.visible:
+            self.draw_background_pil(item)
 
     def end_of_frame(self):
         self.images.append(self.current_image)
@@ -80,41 +174,87 @@ class CanvasWrapper:
         for idx in range(len(route) - 1):
             start = route[idx]
             end = route[idx + 1]
-            self.canvas.create_line(start.x, start.y, end.x, end.y, fill=route.color_as_string())
-
-        def draw_route_pil():
-            for idx in range(len(route) - 1):
-                start = route[idx]
-                end = route[idx + 1]
-                self.current_frame.line([(start.x, start.y), (end.x, end.y)], fill=route.color_as_tuple(), width=1)
-        self.backgrounds.append(draw_route_pil)
+            bounds = (min(start.x, end.x), min(start.y, end.y), max(start.x, end.x), max(start.y, end.y))
+            self.index.insert((route, start, end), bounds)
 
     def draw_station(self, station: Station):
-        self.canvas.create_oval(station.x - station_radius,
-                                station.y - station_radius,
-                                station.x + station_radius,
-                                station.y + station_radius,
-                                fill='#FF0' if station.special else "#FFF",
-                                width=3
-                                )
-        (x, y, anchor) = get_x_y_anchor_for_station_names(station)
-        self.canvas.create_text(x, y, text=station.name, anchor=anchor)
-
-        def draw_station_pil():
-            self.current_frame.ellipse([(station.x - station_radius, station.y - station_radius),
-                                        (station.x + station_radius, station.y + station_radius)],
-                                        outline=(0, 0, 0),
-                                        fill='#FF0' if station.special else "#FFF",
-                                        width=3
+        self.index.insert(station, (station.x, station.y, station.x, station.y))
+
+    def refresh(self):
+        # Redraws the routes and stations in view. Only needed when the view changes.
+        self.visible = self.index.query(self.viewport.get_bounds(view_margin))
+        self.canvas.delete("background")
+        for item in self.visible:
+            self.draw_background_tk(item)
+        self.canvas.tag_lower("background")
+
+    def draw_background_tk(self, item):
+        if isinstance(item, Station):
+            (x, y) = self.viewport.to_screen(item.x, item.y)
+            self.canvas.create_oval(x - station_radius,
+                                    y - station_radius,
+                                    x + station_radius,
+                                    y + station_radius,
+                                    fill='#FF0' if item.special else "#FFF",
+                                    width=3,
+                                    tags="background"
+                                    )
+            (tx, ty, anchor) = get_x_y_anchor_for_station_names(item, x, y)
+            self.canvas.create_text(tx, ty, text=item.name, anchor=anchor, tags="background")
+        else:
+            (route, start, end) = item
+            (x0, y0) = self.viewport.to_screen(start.x, start.y)
+            (x1, y1) = self.viewport.to_screen(end.x, end.y)
+            self.canvas.create_line(x0, y0, x1, y1, fill=route.color_as_string(), tags="background")
+
+    def draw_background_pil(self, item):
+        if isinstance(item, Station):
+            (x, y) = self.viewport.to_screen(item.x, item.y)
+            self.current_frame.ellipse([(x - station_radius, y - station_radius),
+                                        (x + station_radius, y + station_radius)],
+                                       outline=(0, 0, 0),
+                                       fill='#FF0' if item.special else "#FFF",
+                                       width=3
                                        )
-            self.current_frame.text((x, y), station.name, anchor=anchor_map[anchor], fill=(0,0,0), font=self.font)
-        self.backgrounds.append(draw_station_pil)
-
-    def draw_storage(self, point: Station) -> int:
-        x0 = point.x - train_width
-        y0 = point.y - train_width
-        x1 = point.x + train_width
-        y1 = point.y + train_width
+            (tx, ty, anchor) = get_x_y_anchor_for_station_names(item, x, y)
+            self.current_frame.text((tx, ty), item.name, anchor=anchor_map[anchor], fill=(0,0,0), font=self.font)
+        else:
+            (route, start, end) = item
+            self.current_frame.line([self.viewport.to_screen(start.x, start.y), self.viewport.to_screen(end.x, end.y)],
+                                    fill=route.color_as_tuple(), width=1)
+
+    def zoom(self, factor: float, x: int, y: int):
+        self.viewport.zoom(factor, x, y)
+        self.view_changed()
+
+    def start_drag(self, event):
+        self.drag_from = (event.x, event.y)
+
+    def drag(self, event):
+        if self.drag_from is None:
+            return
+        (x, y) = self.drag_from
+        self.viewport.pan(event.x - x, event.y - y)
+        self.drag_from = (event.x, event.y)
+        self.view_changed()
+
+    def reset_view(self):
+        self.viewport.reset()
+        self.view_changed()
+
+    def view_changed(self):
+        self.refresh()
+        for callback in self.on_view_change:
+            callback()
+
+    def draw_storage(self, point: Station) -> Optional[int]:
+        if not self.viewport.is_visible(point.x, point.y, train_width):
+            return None
+        (x, y) = self.viewport.to_screen(point.x, point.y)
+        x0 = x - train_width
+        y0 = y - train_width
+        x1 = x + train_width
+        y1 = y + train_width
         color = "#F0F"
         count = point.get_all_count()
         if count == 2:
@@ -122,33 +262,110 @@ class CanvasWrapper:
         elif count > 2:
             color = "#505"
 
-        self.current_frame.rectangle([(x0, y0), (x1, y1)],
-                                     fill=color,
-                                     outline=(0, 0, 0),
-                                     width=1
-                                     )
+        if self.current_frame is not None:
+            self.current_frame.rectangle([(x0, y0), (x1, y1)],
+                                         fill=color,
+                                         outline=(0, 0, 0),
+                                         width=1
+                                         )
 
         return self.canvas.create_rectangle(x0, y0, x1, y1, fill=color)
 
-    def draw_train(self, x: int, y: int, train: UITrain) -> int:
+    def draw_train(self, x: float, y: float, route: Route) -> Optional[int]:
+        # x and y are map coordinates. Trains out of view aren't drawn at all.
+        if not self.viewport.is_visible(x, y, train_width):
+            return None
+        (x, y) = self.viewport.to_screen(x, y)
         x0 = x - train_width
         y0 = y - train_width
         x1 = x + train_width
         y1 = y + train_width
 
-        self.current_frame.rectangle([(x0, y0), (x1, y1)],
-                                     fill=(255, 0, 0) if train.system == "TRE" else (0, 0, 255),
-                                     outline=(0, 0, 0),
-                                     width=1
-                                     )
+        # Trains are also drawn between frames, after a schedule reload or a change of view
+        if self.current_frame is not None:
+            self.current_frame.rectangle([(x0, y0), (x1, y1)],
+                                         fill=route.train_color_as_tuple(),
+                                         outline=(0, 0, 0),
+                                         width=1
+                                         )
 
         return self.canvas.create_rectangle(
             x0, y0, x1, y1,
-            fill="#F00" if train.system == "TRE" else "#00F"
+            fill=route.train_color_as_string()
         )
 
     def after(self, millis, action):
         self.canvas.after(millis, action)
 
-    def save_gif(self, filename):
-        self.images[0].save(filename, save_all=True, append_images=self.images[1:])
\ No newline at end of file
+    def save_gif(self, filename) -> "GifExport":
+        export = GifExport(self.images, filename)
+        export.start()
+        return export
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class GifExport:
+    """Encodes frames to a GIF on a worker thread, so the window stays responsive.
+
+    The worker never touches Tk; the UI polls frames_done, finished and error instead.
+    """
+    def __init__(self, images: list[Image], filename: str):
+        # Copied, so resetting the canvas doesn't pull frames out from under the worker
+        self.images = list(images)
+        self.filename = filename
+        self.frames_done = 0
+        self.started_at: Optional[float] = None
+        self.finished = False
+        self.error: Optional[Exception] = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def get_frame_count(self) -> int:
+        return len(self.images)
+
+    def get_time_remaining(self) -> Optional[float]:
+        if self.frames_done == 0:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return elapsed / self.frames_done * (self.get_frame_count() - self.frames_done)
+
+    def _frames(self):
+        # Pillow encodes each frame as it asks for the next, so this doubles as progress and a cancel point.
+        for image in self.images[1:]:
+            self.frames_done += 1
+            if self._cancel.is_set():
+                raise ExportCancelled
+            yield image
+
+    def _run(self):
+        # Written beside the output and moved into place, so a cancelled export leaves the old file alone
+        # Any failure, including not being able to create that file, is reported through error.
+        partial = None
+        try:
+            (fd, partial) = tempfile.mkstemp(suffix=".part", dir=os.path.dirname(os.path.abspath(self.filename)))
+            os.close(fd)
+            self.images[0].save(partial, format="GIF", save_all=True, append_images=self._frames())
+            self.frames_done = self.get_frame_count()
+            if self._cancel.is_set():
+                raise ExportCancelled
+            os.replace(partial, self.filename)
+        except Exception as e:
+            if not isinstance(e, ExportCancelled):
+                self.error = e
+            if partial is not None and os.path.exists(partial):
+                os.remove(partial)
+        finally:
+            self.finished = True
\ No newline at end of file